@@ -0,0 +1,71 @@
+`default_nettype none
+`timescale 1ns / 1ps
+
+/* Testbench-only SPI master (mode 0) for driving the DUT's SPI pins.
+   The cocotb test loads a 16-bit word, pulses start, and waits for done;
+   nCS, SCLK and COPI are generated here instead of being toggled from Python.
+*/
+module spi_driver #(
+    parameter HALF_SCLK_CYCLES = 50  // 50 clk periods of 100 ns = 5 us per SCLK phase
+) (
+    input  wire        clk,
+    input  wire        rst_n,
+    input  wire [15:0] word,   // {R/W, address[6:0], data[7:0]}, sent MSB first
+    input  wire        start,  // sampled on posedge clk while idle
+    output reg         done,   // one clk pulse when nCS returns high
+    output reg         nCS,
+    output reg         SCLK,
+    output wire        COPI
+);
+
+  reg [15:0] shift_reg;
+  reg [4:0]  bits_left;
+  reg [6:0]  half_cnt;
+  reg        busy;
+
+  // Drive COPI low while idle so it can be OR'd with the test's own ui_in value
+  assign COPI = busy & shift_reg[15];
+
+  always @(posedge clk or negedge rst_n) begin
+    if (!rst_n) begin
+      done      <= 1'b0;
+      nCS       <= 1'b1;
+      SCLK      <= 1'b0;
+      shift_reg <= 16'd0;
+      bits_left <= 5'd0;
+      half_cnt  <= 7'd0;
+      busy      <= 1'b0;
+    end else begin
+      done <= 1'b0;
+      if (!busy) begin
+        if (start) begin
+          // pull CS low with the first bit already on COPI
+          shift_reg <= word;
+          bits_left <= 5'd16;
+          half_cnt  <= 7'd0;
+          busy      <= 1'b1;
+          nCS       <= 1'b0;
+          SCLK      <= 1'b0;
+        end
+      end else if (half_cnt != HALF_SCLK_CYCLES - 1) begin
+        half_cnt <= half_cnt + 1;
+      end else begin
+        half_cnt <= 7'd0;
+        if (bits_left == 5'd0) begin
+          // all bits sent, return CS high
+          nCS  <= 1'b1;
+          busy <= 1'b0;
+          done <= 1'b1;
+        end else if (!SCLK) begin
+          SCLK <= 1'b1;
+        end else begin
+          // falling edge: shift the next bit onto COPI
+          SCLK      <= 1'b0;
+          shift_reg <= {shift_reg[14:0], 1'b0};
+          bits_left <= bits_left - 1;
+        end
+      end
+    end
+  end
+
+endmodule
@@ -22,6 +22,53 @@ module tb ();
   wire [7:0] uo_out;
   wire [7:0] uio_out;
   wire [7:0] uio_oe;
+  wire pwm_out = uo_out[0];  // single-bit view of OUT_0 for edge triggers
+
+  // 100 ns (10 MHz) clock, generated here so clock edges never enter Python
+  initial clk = 1'b0;
+  always #50 clk = ~clk;
+
+  // Counts the clock cycles OUT_0 is high, cleared by high_count_clr
+  reg        high_count_clr;
+  reg [19:0] high_count;
+
+  initial begin
+    high_count_clr = 1'b0;
+    high_count     = 20'd0;
+  end
+
+  always @(posedge clk) begin
+    if (high_count_clr) high_count <= 20'd0;
+    else if (pwm_out) high_count <= high_count + 1;
+  end
+
+  // SPI master shim: the test loads spi_word, pulses spi_start and waits for spi_done
+  reg  [15:0] spi_word;
+  reg         spi_start;
+  wire        spi_done;
+  wire        spi_ncs;
+  wire        spi_sclk;
+  wire        spi_copi;
+
+  initial begin
+    spi_word  = 16'd0;
+    spi_start = 1'b0;
+  end
+
+  spi_driver spi_driver_inst (
+      .clk  (clk),
+      .rst_n(rst_n),
+      .word (spi_word),
+      .start(spi_start),
+      .done (spi_done),
+      .nCS  (spi_ncs),
+      .SCLK (spi_sclk),
+      .COPI (spi_copi)
+  );
+
+  // Combine the shim with ui_in: while either side sits at its idle level
+  // (nCS=1, COPI=0, SCLK=0) the other one controls the SPI pins
+  wire [7:0] ui_in_dut = {ui_in[7:3], ui_in[2] & spi_ncs, ui_in[1] | spi_copi, ui_in[0] | spi_sclk};
 `ifdef GL_TEST
   wire VPWR = 1'b1;
   wire VGND = 1'b0;
@@ -36,7 +83,7 @@ module tb ();
       .VGND(VGND),
 `endif
 
-      .ui_in  (ui_in),    // Dedicated inputs
+      .ui_in  (ui_in_dut),  // Dedicated inputs
       .uo_out (uo_out),   // Dedicated outputs
       .uio_in (uio_in),   // IOs: Input path
       .uio_out(uio_out),  // IOs: Output path